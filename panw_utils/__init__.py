@@ -5,3 +5,26 @@
 __author__ = """David Paul Cruz"""
 __email__ = 'davidcruz72@gmail.com'
 __version__ = '0.7.10'
+
+import importlib
+
+# Command modules are loaded on first attribute access (PEP 562), importing
+# the package alone never pulls in lxml or netmiko
+_submodules = (
+    'get_panw_api_key',
+    'get_panw_config',
+    'get_panw_firewalls',
+    'get_panw_interfaces',
+    'panw_utils',
+    'run_panw_cmd',
+)
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodules))
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+"""Allow running the commands with python -m panw_utils <command> [options]."""
+
+from panw_utils.panw_utils import main
+
+if __name__ == '__main__':
+    main()
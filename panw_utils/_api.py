@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+'''PAN-OS XML API connection settings shared by the panw-utils commands'''
+
+import ssl
+import urllib.request
+
+# Firewalls and Panorama typically present self-signed certificates, so
+# certificate verification is disabled. Built once and shared by all threads
+ssl_ctx = ssl.create_default_context()
+ssl_ctx.check_hostname = False
+ssl_ctx.verify_mode = ssl.CERT_NONE
+
+# urlopen(context=...) builds a new opener per call, the commands share this one
+opener = urllib.request.build_opener(urllib.request.HTTPSHandler(context=ssl_ctx))
+
+# lxml XMLParser options for API responses: skip xml:id bookkeeping, allow very
+# large responses and never resolve entities (XXE)
+xml_parser_options = {
+    'collect_ids': False,
+    'huge_tree': True,
+    'remove_blank_text': True,
+    'resolve_entities': False,
+}
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+'''Command line argument types shared by the panw-utils commands'''
+
+import argparse
+
+
+def positive_int(value):
+    '''argparse type for counts that must be at least 1, such as pool sizes
+
+    A non-integer raises ValueError, which argparse reports as an invalid value.
+    '''
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {value}')
+    return number
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+'''Saved settings shared by the panw-utils commands'''
+
+import json
+import os
+
+# USERPROFILE first, as Windows users expect. os.path.expanduser() only does that
+# from Python 3.8, earlier versions prefer HOME when it is set
+home_dir = os.environ.get('USERPROFILE') or os.path.expanduser('~')
+settings_path = os.path.join(home_dir, '.panw-settings.json')
+
+
+def load_settings(settings_path, prompts):
+    '''Import saved settings, prompting for and saving any that are missing
+
+    prompts maps each required setting name to the prompt used to ask for it.
+    '''
+    if os.path.exists(settings_path):
+        with open(settings_path, 'r') as f:
+            settings = json.load(f)
+    else:
+        settings = {}
+
+    # Older versions saved default_firewall as a one element list, unwrap it (and resave below).
+    # An empty list is treated as missing, so it is prompted for
+    legacy = isinstance(settings.get('default_firewall'), list)
+    if legacy:
+        firewalls = settings.pop('default_firewall')
+        if firewalls:
+            settings['default_firewall'] = firewalls[0]
+
+    # Check for the existence of settings and add if missing
+    missing = [name for name in prompts if name not in settings]
+    for name in missing:
+        settings[name] = input(prompts[name])
+
+    if missing or legacy:
+        save_settings(settings_path, settings)
+
+    return settings
+
+
+def update_settings(settings_path, settings, prompts):
+    '''Prompt for new values of the saved settings and save them
+
+    prompts maps each setting name to the prompt used to ask for it, an empty
+    answer keeps the current value. The file is left untouched if nothing changed.
+    '''
+    print('\nUpdating saved settings ...\n')
+    changed = False
+    for name, prompt in prompts.items():
+        value = input(f'{prompt} [{settings[name]}]: ') or settings[name]
+        if value != settings[name]:
+            settings[name] = value
+            changed = True
+
+    # Only rewrite the file if a value actually changed
+    if not changed:
+        print('\nSettings unchanged!')
+        return
+    save_settings(settings_path, settings)
+    print('\nSettings updated!')
+
+
+def save_settings(settings_path, settings):
+    '''Atomically replace the saved settings file
+
+    The settings are written to a temporary file beside it and swapped in with
+    os.replace(), so an interrupted write (Ctrl+C) never leaves a truncated file.
+    '''
+    tmp_path = f'{settings_path}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(settings, f, sort_keys=True, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, settings_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    os.chmod(settings_path, 0o600)
@@ -9,7 +9,7 @@ Author: David Cruz (davidcruz72@gmail.com)
 Python version >= 3.6
 
 Required Python packages:
-    None
+    lxml
 
 Features:
     Returns the current API key, suitable for piping to pbcopy (macOS) or clip.exe (Windows)
@@ -24,121 +24,105 @@ Features:
 '''
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
-import json
-import os
-import queue
+import re
 import signal
-import ssl
 import sys
 import threading
-import urllib.request
-import xml.etree.ElementTree as ET
+import urllib.parse
+import lxml.etree as ET
 
-print_queue = queue.Queue()
+from panw_utils._api import opener, xml_parser_options
+from panw_utils._args import positive_int
+from panw_utils._settings import load_settings, settings_path, update_settings
+
+print_lock = threading.Lock()
+
+# Successful keygen responses carry a single <key> element, match it on the raw bytes
+key_regex = re.compile(rb'<key>([^<]+)</key>')
 
 
 def sigint_handler(signum, frame):
     sys.exit(1)
 
 
-def query_api(args, host):
-    # Disable certifcate verification
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-
+def query_api(params, host):
     # Get connected firewalls
-    params = urllib.parse.urlencode({
-        'type': 'keygen',
-        'user': args.user,
-        'password': args.password,
-    })
     url = f'https://{host}/api/?{params}'
     try:
-        with urllib.request.urlopen(url, context=ctx) as response:
-            xml = response.read().decode('utf-8')
+        with opener.open(url) as response:
+            xml = response.read()
     except OSError as err:
+        # sys.exit() inside a pool worker would be swallowed by its future, report and return instead
         sys.stderr.write(f'{host}: Unable to connect to host ({err})\n')
-        sys.exit(1)
+        return
 
     return xml
 
 
-def worker(args, host):
-    xml = query_api(args, host)
+def worker(args, params, host):
+    # Failed hosts are reported on stderr and return False, the other firewalls are still queried
+    xml = query_api(params, host)
+    if xml is None:
+        return False
 
-    # Parse and print the API key
-    root = ET.fromstring(xml)
-    try:
-        api_key = root.find(".//key").text
-    except AttributeError as err:
-        sys.stderr.write(f'Unable to parse API key! ({err})\n')
-        sys.exit(1)
+    # Parse and print the API key, only falling back to the XML parser on a miss (error responses)
+    match = key_regex.search(xml)
+    if match:
+        api_key = match.group(1).decode('utf-8')
+    else:
+        try:
+            # lxml parsers are not thread safe, build one per (rare) error response
+            root = ET.fromstring(xml, ET.XMLParser(**xml_parser_options))
+        except ET.XMLSyntaxError as err:
+            sys.stderr.write(f'{host}: Unable to parse XML! ({err})\n')
+            return False
+        api_key = root.findtext('.//key')
+        if api_key is None:
+            sys.stderr.write(f'{host}: Unable to parse API key! ({root.findtext(".//msg") or "no key in response"})\n')
+            return False
 
     if args.verbose:
-        print_queue.put(f'{host + ": " :30}{api_key}')
+        line = f'{host + ": " :30}{api_key}\n'
     else:
-        print_queue.put(api_key)
+        line = f'{api_key}\n'
 
+    with print_lock:
+        sys.stdout.write(line)
 
-def print_manager():
-    while True:
-        job = print_queue.get()
-        print(job)
-        print_queue.task_done()
+    return True
 
 
-def main():
-    # Ctrl+C graceful exit
-    signal.signal(signal.SIGINT, sigint_handler)
-
+def parse_args():
     parser = argparse.ArgumentParser(description='Returns the current API key, suitable for piping to pbcopy (macOS) or clip.exe (Windows)')
     parser.add_argument('hosts', type=str, metavar='', nargs='*', help='Space separated list of firewalls')
     parser.add_argument('-u', '--user', type=str, metavar='', help='API service account username')
     parser.add_argument('-p', '--password', type=str, metavar='', help='API service account password')
     parser.add_argument('-U', '--update', action='store_true', help='Update saved settings')
     parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose output')
-    args = parser.parse_args()
+    parser.add_argument('--concurrency', metavar='', type=positive_int, default=25, help='Maximum concurrent API requests (default is 25)')
+    return parser.parse_args()
 
-    if 'USERPROFILE' in os.environ:
-        settings_path = os.path.join(os.environ["USERPROFILE"], '.panw-settings.json')
-    else:
-        settings_path = os.path.join(os.environ["HOME"], '.panw-settings.json')
+
+def main():
+    # Ctrl+C graceful exit
+    signal.signal(signal.SIGINT, sigint_handler)
+
+    args = parse_args()
 
     # Import saved settings
-    if os.path.exists(settings_path):
-        with open(settings_path, 'r') as f:
-            settings = json.load(f)
-
-        # Check for the existence of settings and add if missing
-        changed = False
-        if not 'default_firewall' in settings:
-            settings['default_firewall'] = input(f'Default Firewall: ')
-            changed = True
-        if not 'default_user' in settings:
-            settings['default_user'] = input(f'Default User: ')
-            changed = True
-        if changed:
-            with open(settings_path, 'w') as f:
-                json.dump(settings, f, sort_keys=True, indent=2)
-    else:
-        settings = {
-            'default_firewall': input('Default Firewall: '),
-            'default_user': input('Default User: '),
-        }
-        with open(settings_path, 'w') as f:
-            json.dump(settings, f, sort_keys=True, indent=2)
-        os.chmod(settings_path, 0o600)
+    settings = load_settings(settings_path, {
+        'default_firewall': 'Default Firewall: ',
+        'default_user': 'Default User: ',
+    })
 
     # Update saved settings
     if args.update:
-        print('\nUpdating saved settings ...\n')
-        settings['default_firewall'] = input(f'New Default Firewall [{settings["default_firewall"]}]: ') or settings['default_firewall']
-        settings['default_user'] = input(f'New Default User [{settings["default_user"]}]: ') or settings['default_user']
-        with open(settings_path, 'w') as f:
-            json.dump(settings, f, sort_keys=True, indent=2)
-        print('\nSettings updated!')
+        update_settings(settings_path, settings, {
+            'default_firewall': 'New Default Firewall',
+            'default_user': 'New Default User',
+        })
         sys.exit(0)
 
     # Receive firewalls from stdin
@@ -152,30 +136,29 @@ def main():
     elif not args.hosts:
         args.hosts = [settings['default_firewall']]
 
+    # Each host is resolved and queried once, even if listed more than once
+    args.hosts = list(dict.fromkeys(args.hosts))
+
     if not args.user:
         args.user = settings['default_user']
 
     if not args.password:
         args.password = getpass(f'Password ({args.user}): ')
 
-    # Start print manager
-    t = threading.Thread(target=print_manager)
-    t.daemon = True
-    t.start()
-    del t
-
-    worker_threads = []
-    for host in args.hosts:
-        t = threading.Thread(target=worker, args=(args, host))
-        worker_threads.append(t)
-        t.start()
-
-    for t in worker_threads:
-        t.join()
+    # Only the host varies between requests, encode the query string once
+    params = urllib.parse.urlencode({
+        'type': 'keygen',
+        'user': args.user,
+        'password': args.password,
+    })
 
-    print_queue.join()
+    # Bounded pool, threads are only spawned as needed so small runs stay small
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(worker, args, params, host) for host in args.hosts]
+        # result() re-raises anything unexpected from a worker rather than dropping it with the future
+        succeeded = [future.result() for future in futures]
 
-    sys.exit(0)
+    sys.exit(0 if all(succeeded) else 1)
 
 
 if __name__ == '__main__':
@@ -21,22 +21,17 @@ Features:
 '''
 
 import argparse
+from concurrent.futures import as_completed, ThreadPoolExecutor
 from getpass import getpass
-import json
-from collections import namedtuple
-from netmiko import ConnectHandler
-import operator
 import os
 import os.path
-import queue
-import re
 import signal
-import ssl
 import sys
-import threading
-import urllib.request
+import urllib.parse
 
-print_queue = queue.Queue()
+from panw_utils._api import opener
+from panw_utils._args import positive_int
+from panw_utils._settings import home_dir, load_settings, settings_path, update_settings
 
 
 def sigint_handler(signum, frame):
@@ -55,10 +50,14 @@ def parse_args():
     group1.add_argument('-u', '--user', metavar='', type=str, help='User')
     group1.add_argument('-p', '--password', metavar='', type=str, help='Password')
     group1.add_argument('-K', '--key-based-auth', action='store_true', help='Use key based authentication')
+    group1.add_argument('--ssh-concurrency', metavar='', type=positive_int, default=8,
+                        help='Maximum concurrent SSH sessions, keep below the firewall sshd MaxStartups (default is 8)')
 
     group2 = parser.add_argument_group('XML configuration format')
     group2.add_argument('-k', '--key', metavar='', type=str, help='API key')
     group2.add_argument('-x', '--xpath', metavar='', type=str, help='XML XPath')
+    group2.add_argument('--api-concurrency', metavar='', type=positive_int, default=25,
+                        help='Maximum concurrent API requests (default is 25)')
     group2.add_argument('-t', choices=['running',
                                        'candidate',
                                        'pushed-template',
@@ -69,82 +68,41 @@ def parse_args():
     return parser.parse_args()
 
 
-def import_saved_settings(settings_path):
-    if os.path.exists(settings_path):
-        with open(settings_path, 'r') as f:
-            settings = json.load(f)
-
-        # Check for the existence of settings and add if missing
-        changed = False
-        if not 'default_firewall' in settings:
-            settings['default_firewall'] = input(f'Default Firewall: ')
-            changed = True
-        if not 'key' in settings:
-            settings['key'] = input('API Key: ')
-            changed = True
-        if not 'default_user' in settings:
-            settings['default_user'] = input('Default User: ')
-            changed = True
-        if changed:
-            with open(settings_path, 'w') as f:
-                json.dump(settings, f, sort_keys=True, indent=2)
-    else:
-        settings = {
-            'default_firewall': [input('Default Firewall: ')],
-            'default_user': input('Default User: '),
-            'key': input('API Key: '),
-        }
-        with open(settings_path, 'w') as f:
-            json.dump(settings, f, sort_keys=True, indent=2)
-        os.chmod(settings_path, 0o600)
-
-    return settings
-
-
-def update_saved_settings(settings, settings_path):
-    print('\nUpdating saved settings ...\n')
-    settings['default_firewall'] = input(
-        f'New Default Firewall [{settings["default_firewall"]}]: ') or settings['default_firewall']
-    settings['default_user'] = input(f'New Default User [{settings["default_user"]}]: ') or settings['default_user']
-    settings['key'] = input(f'New API Key [{settings["key"]}]: ') or settings['key']
-    with open(settings_path, 'w') as f:
-        json.dump(settings, f, sort_keys=True, indent=2)
-    print('\nSettings updated!')
-
-
-def query_api(args, host):
-    # Disable certifcate verification
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-
-    # Get connected firewalls
+def build_params(args):
+    # The query string is the same for every firewall, only the host varies
     if args.xpath:
-        params = urllib.parse.urlencode({
+        return urllib.parse.urlencode({
             'xpath': args.xpath,
             'type': 'config',
             'action': 'show',
             'key': args.key,
         })
-    else:
-        params = urllib.parse.urlencode({
-            'type': 'op',
-            'cmd': f'<show><config><{args.t}></{args.t}></config></show>',
-            'key': args.key,
-        })
+    return urllib.parse.urlencode({
+        'type': 'op',
+        'cmd': f'<show><config><{args.t}></{args.t}></config></show>',
+        'key': args.key,
+    })
+
+
+def query_api(params, host):
+    # Get connected firewalls
     url = f'https://{host}/api/?{params}'
     try:
-        with urllib.request.urlopen(url, context=ctx) as response:
+        with opener.open(url) as response:
             xml_config = response.read()
-            xml_config = '\n'.join(str(xml_config).split('\\n'))
+        # Keep non printable Unicode characters escaped (Windows stdout issue), restore line breaks
+        xml_config = str(xml_config).replace('\\n', '\n')
     except OSError as err:
         sys.stderr.write(f'{host}: Unable to connect to host ({err})\n')
         return
 
-    print_config(xml_config, host)
+    return xml_config
 
 
 def connect_ssh(args, settings, key_path, host):
+    # Netmiko (paramiko, cryptography) is slow to import, only load it for the set format
+    from netmiko import ConnectHandler
+
     panos = {
         'host': host,
         'device_type': 'paloalto_panos',
@@ -160,39 +118,43 @@ def connect_ssh(args, settings, key_path, host):
         panos['key_file'] = key_path
         panos['use_keys'] = True
 
+    net_connect = None
     try:
         net_connect = ConnectHandler(**panos)
         set_config = net_connect.send_command('set cli config-output-format set')
         set_config = net_connect.send_config_set(['show'])
-        net_connect.disconnect()
     except Exception as e:
+        # Report the failed host and let the rest of the batch carry on
         sys.stderr.write(f'Connection error ({host}): {e}\n')
-        sys.exit(1)
+        return
+    finally:
+        if net_connect is not None:
+            net_connect.disconnect()
 
     # Replace non printable Unicode characters to fix Windows stdout issue
     set_config = str(set_config.encode('utf-8'))
 
-    # Remove extraneous leading/trailing output
-    set_config = '\n'.join(set_config.split('\\n')[4:-4])
+    # Remove extraneous leading/trailing output, restore line breaks
+    set_config = trim_lines(set_config, '\\n', 4).replace('\\n', '\n')
 
-    print_config(set_config, host)
+    return set_config
 
 
-def print_config(config, host):
-    print_queue.put([
-        f'{"=" * (len(host) + 4)}',
-        f'= {host} =',
-        f'{"=" * (len(host) + 4)}',
-        config,
-    ])
+def trim_lines(text, sep, count):
+    # Same as sep.join(text.split(sep)[count:-count]), but bounded splits only copy the kept middle once
+    head = text.split(sep, count)
+    if len(head) <= count:
+        return ''
+    tail = head[count].rsplit(sep, count)
+    if len(tail) <= count:
+        return ''
+    return tail[0]
 
 
-def print_manager():
-    while True:
-        job = print_queue.get()
-        for line in job:
-            print(line)
-        print_queue.task_done()
+def print_config(config, host):
+    # Emit the banner and configuration in one write
+    border = '=' * (len(host) + 4)
+    sys.stdout.write(f'{border}\n= {host} =\n{border}\n{config}\n')
 
 
 def main():
@@ -201,16 +163,19 @@ def main():
 
     args = parse_args()
 
-    if os.environ.get('USERPROFILE'):
-        settings_path = os.path.join(os.environ.get('USERPROFILE'), '.panw-settings.json')
-        key_path = os.path.join(os.environ.get('USERPROFILE'), '.ssh', 'id_rsa')
-    else:
-        settings_path = os.path.join(os.environ.get('HOME'), '.panw-settings.json')
-        key_path = os.path.join(os.environ.get('HOME'), '.ssh', 'id_rsa')
-    settings = import_saved_settings(settings_path)
+    key_path = os.path.join(home_dir, '.ssh', 'id_rsa')
+    settings = load_settings(settings_path, {
+        'default_firewall': 'Default Firewall: ',
+        'default_user': 'Default User: ',
+        'key': 'API Key: ',
+    })
 
     if args.update:
-        update_saved_settings(settings, settings_path)
+        update_settings(settings_path, settings, {
+            'default_firewall': 'New Default Firewall',
+            'default_user': 'New Default User',
+            'key': 'New API Key',
+        })
         sys.exit(0)
 
     # Receive firewalls from stdin
@@ -223,39 +188,31 @@ def main():
         args.key = settings['key']
     if not args.firewalls:
         args.firewalls = [settings['default_firewall']]
+    # Fetch each configuration once, even if a firewall is listed more than once
+    args.firewalls = list(dict.fromkeys(args.firewalls))
     if not args.user:
         args.user = settings['default_user']
     if args.format == 'set' and not args.key_based_auth and not args.password:
         args.password = getpass(f"Password ({args.user}): ")
 
-    # Start print manager
-    t = threading.Thread(target=print_manager)
-    t.daemon = True
-    t.start()
-    del t
-
-    # Collect, process and print configuration
+    # Collect and process configuration, workers return it to be printed here as each one finishes
     if args.format == 'xml':
-        worker_threads = []
-        for host in args.firewalls:
-            t = threading.Thread(target=query_api, args=(args, host))
-            worker_threads.append(t)
-            t.start()
-
-        for t in worker_threads:
-            t.join()
+        params = build_params(args)
+        with ThreadPoolExecutor(max_workers=args.api_concurrency) as executor:
+            futures = {executor.submit(query_api, params, host): host for host in args.firewalls}
+            for future in as_completed(futures):
+                config = future.result()
+                if config is not None:
+                    print_config(config, futures[future])
     elif args.format == 'set':
         print('Connecting via SSH ...', file=sys.stderr)
-        worker_threads = []
-        for host in args.firewalls:
-            t = threading.Thread(target=connect_ssh, args=(args, settings, key_path, host))
-            worker_threads.append(t)
-            t.start()
-
-        for t in worker_threads:
-            t.join()
-
-    print_queue.join()
+        # Netmiko sessions are heavyweight (a paramiko transport thread each), keep fewer in flight
+        with ThreadPoolExecutor(max_workers=args.ssh_concurrency) as executor:
+            futures = {executor.submit(connect_ssh, args, settings, key_path, host): host for host in args.firewalls}
+            for future in as_completed(futures):
+                config = future.result()
+                if config is not None:
+                    print_config(config, futures[future])
 
     sys.exit(0)
 
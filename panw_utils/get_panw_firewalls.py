@@ -9,7 +9,7 @@ Author: David Cruz (davidcruz72@gmail.com)
 Python version >= 3.6
 
 Required Python packages:
-    None
+    lxml
 
 Features:
     Returns a list of firewalls including management address and serial number
@@ -23,27 +23,27 @@ Features:
 '''
 
 import argparse
-import json
-import os
-import os.path
+from collections import namedtuple
+from operator import attrgetter
 import signal
-import ssl
 import sys
-import xml.dom.minidom as MD
-import xml.etree.ElementTree as ET
 from urllib import parse
-from urllib.request import urlopen
+import lxml.etree as ET
+
+from panw_utils._api import opener, xml_parser_options
+from panw_utils._settings import load_settings, settings_path, update_settings
+
+# One row per firewall, in output column order
+Firewall = namedtuple('Firewall', 'hostname mgmt_ip serial model connected uptime sw_version')
+
+# Column layout shared by the header and every row, bound once so rows are formatted straight from a Firewall
+row_format = '{:30}\t{:15}\t{:12}\t{:8}\t{:9}\t{:20}\t{:9}'.format
 
 
 def sigint_handler(signum, frame):
     sys.exit(1)
 
 def query_api(args):
-    # Disable certifcate verification
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-
     # Get connected firewalls
     if args.state == 'connected':
         cmd = '<show><devices><connected></connected></devices></show>'
@@ -56,78 +56,64 @@ def query_api(args):
     })
     url = f'https://{args.panorama}/api/?{params}'
     try:
-        with urlopen(url, context=ctx) as response:
-            xml = response.read().decode('utf-8')
+        response = opener.open(url)
     except OSError as err:
         sys.stderr.write(f'{args.panorama}: Unable to connect to host ({err})\n')
         sys.exit(1)
 
-    return xml
+    return response
+
+def parse_xml(args, response):
+    # Yield firewalls as their entries are parsed, the caller decides what to materialize
+    for _, firewall in ET.iterparse(response, events=('end',), tag='entry', **xml_parser_options):
+        # Nested entries (vsys, etc.) are released along with their device entry
+        if firewall.getparent().tag != 'devices':
+            continue
+
+        # Drop already processed entries so memory stays flat on large Panoramas
+        while firewall.getprevious() is not None:
+            del firewall.getparent()[0]
 
-def parse_xml(args, root):
-    results = {}
-    for firewall in root.findall('./result/devices/entry'):
-        connected = firewall.find('connected').text
+        findtext = firewall.findtext
+        connected = findtext('connected') or 'no'
         if (args.state == 'disconnected' or args.state == 'not-connected') and connected == 'yes':
             continue
 
-        try:
-            hostname = f'{firewall.find("hostname").text.lower()}.wsgc.com'
-        except AttributeError:
-            hostname = 'n/a'
-        try:
-            serial = firewall.find('serial').text
-        except AttributeError:
-            serial = 'n/a'
-        try:
-            mgmt_ip = firewall.find('ip-address').text
-        except AttributeError:
-            mgmt_ip = 'n/a'
-        try:
-            model = firewall.find('model').text
-        except AttributeError:
-            model = 'n/a'
-        try:
-            uptime = firewall.find('uptime').text
-        except AttributeError:
-            uptime = 'n/a'
-        try:
-            sw_version = firewall.find('sw-version').text
-        except AttributeError:
-            sw_version = 'n/a'
-
-        results.update({
-            serial: {
-                'hostname': hostname,
-                'mgmt_ip': mgmt_ip,
-                'model': model,
-                'connected': connected,
-                'uptime': uptime,
-                'sw_version': sw_version,
-            }
-        })
+        # findtext() returns the text directly, without building an Element or raising per missing field
+        hostname = findtext('hostname')
+        hostname = f'{hostname.lower()}.wsgc.com' if hostname else 'n/a'
+        serial = findtext('serial') or 'n/a'
+        mgmt_ip = findtext('ip-address') or 'n/a'
+        model = findtext('model') or 'n/a'
+        uptime = findtext('uptime') or 'n/a'
+        sw_version = findtext('sw-version') or 'n/a'
+
+        yield Firewall(hostname, mgmt_ip, serial, model, connected, uptime, sw_version)
 
-    return results
+def sort_firewalls(firewalls):
+    # Sort by hostname with a plain string key (no per-row tuple), then move firewalls without a hostname last
+    firewalls = sorted(firewalls, key=attrgetter('hostname'))
+    return [fw for fw in firewalls if fw.hostname != 'n/a'] + [fw for fw in firewalls if fw.hostname == 'n/a']
 
 def output(args, results):
-    # Print header
-    if not args.terse:
-        print(f'{"Host" :30}\t{"MgmtIP" :15}\t{"Serial" :12}\t{"Model" :8}\t{"Connected" :9}\t{"Uptime" :20}\t{"SwVersion" :9}')
-        print(f'{"=" * 30 :30}\t{"=" * 15 :15}\t{"=" * 12 :12}\t{"=" * 8 :8}\t{"=" * 9 :9}\t{"=" * 20 :20}\t{"=" * 9 :9}')
-
-    for serial, attrib in results.items():
-        if args.terse:
-            if attrib['hostname'] != 'n/a':
-                print(attrib['hostname'])
-        else:
-            print(f'{attrib["hostname"] :30}\t{attrib["mgmt_ip"] :15}\t{serial :12}\t{attrib["model"] :8}\t{attrib["connected"] :9}\t{attrib["uptime"] :20}\t{attrib["sw_version"] :9}')
+    # Collect every line and emit them with a single write
+    lines = []
 
-    return
+    if args.terse:
+        lines = [fw.hostname for fw in results if fw.hostname != 'n/a']
+    else:
+        # Header
+        lines.append(row_format('Host', 'MgmtIP', 'Serial', 'Model', 'Connected', 'Uptime', 'SwVersion'))
+        lines.append(row_format('=' * 30, '=' * 15, '=' * 12, '=' * 8, '=' * 9, '=' * 20, '=' * 9))
 
-def main():
-    # Ctrl+C graceful exit
-    signal.signal(signal.SIGINT, sigint_handler)
+        lines.extend(row_format(*fw) for fw in results)
 
+    if lines:
+        sys.stdout.write('\n'.join(lines) + '\n')
+
+    return
+
+def parse_args():
     parser = argparse.ArgumentParser(description='Returns a list of firewalls including management address and serial number')
     parser.add_argument('panorama', type=str, nargs='?', help='Panorama device to query')
     parser.add_argument('-k', '--key', metavar='', type=str, help='API key')
@@ -135,46 +121,26 @@ def main():
     parser.add_argument('-s', '--state', choices=['connected', 'disconnected', 'not-connected', 'any', 'all'], default='all', help='Connection state')
     parser.add_argument('-t', '--terse', action='store_true', help='Output firewall names only')
     parser.add_argument('-U', '--update', action='store_true', help='Update saved settings')
-    args = parser.parse_args()
+    return parser.parse_args()
 
-    if 'USERPROFILE' in os.environ:
-        settings_path = os.path.join(os.environ["USERPROFILE"], '.panw-settings.json')
-    else:
-        settings_path = os.path.join(os.environ["HOME"], '.panw-settings.json')
+def main():
+    # Ctrl+C graceful exit
+    signal.signal(signal.SIGINT, sigint_handler)
+
+    args = parse_args()
 
     # Import saved settings
-    if os.path.exists(settings_path):
-        with open(settings_path, 'r') as f:
-            settings = json.load(f)
-
-        # Check for the existence of settings and add if missing
-        changed = False
-        if not 'default_panorama' in settings:
-            settings['default_panorama'] = input(f'Default Panorama Host: ')
-            changed = True
-        if not 'key' in settings:
-            settings['key'] = input('API Key: ')
-            changed = True
-        if changed:
-            with open(settings_path, 'w') as f:
-                json.dump(settings, f, sort_keys=True, indent=2)
-    else:
-        settings = {
-            'key': input('API Key: '),
-            'default_panorama': input('Default Panorama Host: '),
-        }
-        with open(settings_path, 'w') as f:
-            json.dump(settings, f, sort_keys=True, indent=2)
-        os.chmod(settings_path, 0o600)
+    settings = load_settings(settings_path, {
+        'key': 'API Key: ',
+        'default_panorama': 'Default Panorama Host: ',
+    })
 
     # Update saved settings
     if args.update:
-        print('\nUpdating saved settings ...\n')
-        settings['key'] = input(f'New API Key [{settings["key"]}]: ') or settings['key']
-        settings['default_panorama'] = input(f'New Default Panorama Host [{settings["default_panorama"]}]: ') or settings['default_panorama']
-        with open(settings_path, 'w') as f:
-            json.dump(settings, f, sort_keys=True, indent=2)
-        print('\nSettings updated!')
+        update_settings(settings_path, settings, {
+            'key': 'New API Key',
+            'default_panorama': 'New Default Panorama Host',
+        })
         sys.exit(0)
 
     if not args.key:
@@ -182,23 +148,23 @@ def main():
     if not args.panorama:
         args.panorama = settings['default_panorama']
 
-    xml = query_api(args)
-
-    # Pretty print XML
-    if args.raw_output:
-        print(MD.parseString(xml).toprettyxml(indent='  '))
-        sys.exit(0)
-
-    try:
-        root = ET.fromstring(xml)
-    except TypeError as err:
-        sys.stderr.write(f'Unable to parse XML! ({err})\n')
-        sys.exit(1)
-
-    firewalls = parse_xml(args, root)
-
-    sorted_firewalls = dict(sorted(firewalls.items(), key=lambda i: (i[1]['hostname'] == 'n/a', i[1]['hostname'])))
-    output(args, sorted_firewalls)
+    # Stream the response straight into the parser rather than buffering it
+    with query_api(args) as response:
+        try:
+            # Pretty print XML
+            if args.raw_output:
+                root = ET.parse(response, ET.XMLParser(**xml_parser_options)).getroot()
+                # Serialize and indent in one libxml2 pass (blank text is already stripped by the parser)
+                sys.stdout.write(ET.tostring(root, pretty_print=True, encoding='unicode'))
+                sys.exit(0)
+
+            # Output is sorted, so the firewalls are consumed into one list while the response is open
+            firewalls = sort_firewalls(parse_xml(args, response))
+        except ET.XMLSyntaxError as err:
+            sys.stderr.write(f'Unable to parse XML! ({err})\n')
+            sys.exit(1)
+
+    output(args, firewalls)
 
     sys.exit(0)
 
@@ -25,286 +25,248 @@ Features:
 '''
 
 import argparse
-import json
-import os
-import os.path
-import queue
+from concurrent.futures import as_completed, ThreadPoolExecutor
+import http.client
+import io
+from operator import attrgetter
 import re
 import signal
-import ssl
 import sys
-import threading
-import urllib.request
+import urllib.parse
 import lxml.etree as ET
 
-results = []
+from panw_utils._api import ssl_ctx, xml_parser_options
+from panw_utils._args import positive_int
+from panw_utils._settings import load_settings, settings_path, update_settings
 
-print_queue = queue.Queue()
-results_queue = queue.Queue()
+form_headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+# Physical ethernet interfaces (not subinterfaces)
+ethernet_regex = re.compile(r'^ethernet\d+/\d+$')
+
+# First IPv4 address in an interface's ip field (unanchored, so search() needs no .* padding)
+ipv4_regex = re.compile(r'(\d{1,3}(?:\.\d{1,3}){3})')
+
+# Runs of digits in an interface name, compared as numbers so ethernet1/2 sorts before ethernet1/10
+digits_regex = re.compile(r'(\d+)')
+
+# Output columns and the Interface attribute each one shows
+columns = {
+    'Firewall': 'firewall',
+    'Interface': 'ifname',
+    'LinkState': 'link_state',
+    'Status': 'status',
+    'MacAddress': 'mac_address',
+    'AggGrp': 'agg_grp',
+    'Zone': 'zone',
+    'IpAddress': 'ip_address',
+    'vSys': 'vsys',
+    'VirtualRouter': 'vrouter',
+    'Comment': 'comment',
+}
+
+
+class Interface:
+    # Fixed slots rather than a dict per interface, columns a firewall doesn't report stay None
+    __slots__ = tuple(columns.values())
+
+    def __init__(self, firewall, ifname):
+        self.firewall = firewall
+        self.ifname = ifname
+        self.link_state = self.status = self.mac_address = self.agg_grp = None
+        self.zone = self.ip_address = self.vsys = self.vrouter = self.comment = None
 
 
 def sigint_handler(signum, frame):
     sys.exit(1)
 
 
-def query_api(host, params):
-    # Disable certifcate verification
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
+def sort_key(if_attrs):
+    # Built once per interface by sort(), not per comparison
+    ifname = tuple(int(part) if part.isdigit() else part for part in digits_regex.split(if_attrs.ifname))
+    return if_attrs.firewall, ifname
 
-    # Get connected firewalls
-    params = urllib.parse.urlencode(params)
-    url = f'https://{host}/api/?{params}'
 
+def query_api(conn, host, params, parser=None):
+    # Requests share the worker's keep-alive connection, only the first one pays for the TLS handshake.
+    # POST keeps the API key out of the request line (and the firewall's web server logs)
     try:
-        with urllib.request.urlopen(url, context=ctx) as response:
-            xml = response.read().decode('utf-8')
-    except OSError as err:
+        conn.request('POST', '/api/', body=params, headers=form_headers)
+        response = conn.getresponse()
+        if parser is not None and response.status == 200:
+            # Parse the body as it arrives instead of buffering it first, returns the root element
+            for chunk in iter(lambda: response.read(65536), b''):
+                parser.feed(chunk)
+            xml = parser.close()
+        else:
+            xml = response.read()
+    except (OSError, http.client.HTTPException) as err:
         sys.stderr.write(f'{host}: Unable to connect to host ({err})\n')
-        sys.exit(1)
+        return
+    except ET.XMLSyntaxError as err:
+        sys.stderr.write(f'{host}: Unable to parse XML! ({err})\n')
+        return
+
+    if response.status != 200:
+        sys.stderr.write(f'{host}: Unable to connect to host (HTTP Error {response.status}: {response.reason})\n')
         return
 
     return xml
 
 
-def parse_interfaces(root, hostname):
+def parse_interfaces(xml, hostname):
     interfaces = {}
 
-    hw = root.findall('./result/hw/entry')
-    for int in hw:
-        ifname = int.find('name').text
-        mac = int.find('mac').text
-        status = int.find('st').text
-
-        interfaces[ifname] = {
-            'Firewall': hostname,
-            'MacAddress': mac,
-            'Status': status
-        }
-
-    ifnet = root.findall('./result/ifnet/entry')
-    for int in ifnet:
-        ifname = int.find('name').text
-        ip = int.find('ip').text or 'N/A'
-        zone = int.find('zone').text or 'N/A'
-        vsys = int.find("vsys").text
-        vsys = f'vsys{int.find("vsys").text}' if vsys != '0' else 'N/A'
-
-        interfaces[ifname] = {
-            **interfaces.get(ifname, {}),
-            'Firewall': hostname,
-            'Zone': zone,
-            'IpAddress': ip,
-            'vSys': vsys
-        }
+    # Stream the hw/ifnet entries rather than building the whole tree first
+    for _, entry in ET.iterparse(io.BytesIO(xml), events=('end',), tag='entry', **xml_parser_options):
+        section = entry.getparent().tag
+        if section != 'hw' and section != 'ifnet':
+            continue
+
+        # Read all the entry's fields in one pass over its children rather than a find() per field
+        fields = {child.tag: child.text for child in entry}
+
+        # Either section can come first, add to the interface's record in place
+        ifname = fields['name']
+        attrs = interfaces.get(ifname)
+        if attrs is None:
+            attrs = interfaces[ifname] = Interface(hostname, ifname)
+
+        if section == 'hw':
+            attrs.mac_address = fields.get('mac')
+            attrs.status = fields.get('st')
+        else:
+            ip = fields.get('ip') or 'N/A'
+            zone = fields.get('zone') or 'N/A'
+            vsys = fields.get('vsys')
+            vsys = f'vsys{vsys}' if vsys and vsys != '0' else 'N/A'
+
+            attrs.zone = zone
+            attrs.ip_address = ip
+            attrs.vsys = vsys
+
+        # Drop already processed entries so memory stays flat on large chassis
+        while entry.getprevious() is not None:
+            del entry.getparent()[0]
 
     return interfaces
 
 
 def parse_interface_config(root, interfaces):
-    for ifname, attrs in interfaces.items():
-        try:
-            attrs['Comment'] = root.find(f'./result/network/interface/ethernet/entry[@name="{ifname}"]/comment').text
-        except AttributeError:
-            attrs['Comment'] = ''
+    # Fills in the parsed interfaces' config attributes in place, nothing is returned.
+    # Index the ethernet entries once instead of searching the config per interface
+    ethernets = {entry.get('name'): entry for entry in root.iterfind('./result/network/interface/ethernet/entry')}
 
-        # Collect the link state of physical interfaces only
-        if re.match(r'^ethernet\d+/\d+$', ifname):
-            try:
-                attrs['LinkState'] = root.find(f'./result/network/interface/ethernet/entry[@name="{ifname}"]/link-state').text
-            except AttributeError:
-                # Default interface state auto returns nothing
-                attrs['LinkState'] = 'auto'
+    # Map each interface to its virtual router, walking only the virtual-router entries rather than
+    # every member in the config. An interface belongs to one virtual router, the first one wins otherwise
+    vrouters = {}
+    for vrouter in root.iterfind('./result/network/virtual-router/entry'):
+        name = vrouter.get('name')
+        for member in vrouter.iterfind('./interface/member'):
+            vrouters.setdefault(member.text, name)
 
-        # Collect the aggregate-group
-        if re.match(r'^ethernet\d+/\d+$', ifname):
-            try:
-                attrs['AggGrp'] = root.find(f'./result/network/interface/ethernet/entry[@name="{ifname}"]/aggregate-group').text
-            except AttributeError:
-                # Default interface state auto returns nothing
-                attrs['AggGrp'] = 'N/A'
+    # Interfaces without ethernet config read from an empty entry, so findtext() returns the defaults
+    no_config = ET.Element('entry')
 
-        try:
-            vrouter = root.xpath(f'//member[text()="{ifname}"]')[0].getparent().getparent().get('name')
-            attrs['VirtualRouter'] = vrouter if vrouter != None else 'N/A'
-        except IndexError:
-            attrs['VirtualRouter'] = 'N/A'
+    for ifname, attrs in interfaces.items():
+        ethernet = ethernets.get(ifname, no_config)
 
-    return interfaces
+        attrs.comment = ethernet.findtext('comment', '')
 
+        # Collect the link state and aggregate-group of physical interfaces only
+        if ethernet_regex.match(ifname):
+            # Default interface state auto returns nothing
+            attrs.link_state = ethernet.findtext('link-state', 'auto')
+            attrs.agg_grp = ethernet.findtext('aggregate-group', 'N/A')
 
-def get_field_width(field, interfaces):
-    field_width = [len(field)]
-    if field == 'Interface':
-        for int in interfaces:
-            for ifname in int.keys():
-                field_width.append(len(ifname))
-    else:
-        for int in interfaces:
-            for attrs in int.values():
-                field_width.append(len(attrs.get(field, '')))
-    return max(field_width)
+        attrs.vrouter = vrouters.get(ifname, 'N/A')
 
 
 def print_results(args, results):
-    if args.terse:
-        regex = re.compile(r'.*?(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}).*$')
-    else:
-        fields = {
-            'Firewall': {
-                'width': get_field_width('Firewall', results),
-                'na': 'N/A'
-            },
-            'Interface': {
-                'width': get_field_width('Interface', results),
-                'na': 'N/A'
-            },
-            'LinkState': {
-                'width': get_field_width('LinkState', results),
-                'na': 'N/A'
-            },
-            'Status': {
-                'width': get_field_width('Status', results),
-                'na': 'N/A'
-            },
-            'MacAddress': {
-                'width': get_field_width('MacAddress', results),
-                'na': 'N/A'
-            },
-            'AggGrp': {
-                'width': get_field_width('AggGrp', results),
-                'na': 'N/A'
-            },
-            'Zone': {
-                'width': get_field_width('Zone', results),
-                'na': 'N/A'
-            },
-            'IpAddress': {
-                'width': get_field_width('IpAddress', results),
-                'na': 'N/A'
-            },
-            'vSys': {
-                'width': get_field_width('vSys', results),
-                'na': 'N/A'
-            },
-            'VirtualRouter': {
-                'width': get_field_width('VirtualRouter', results),
-                'na': 'N/A'
-            },
-            'Comment': {
-                'width': get_field_width('Comment', results),
-                'na': ''
-            },
-        }
-
-        # Print header
-        header = ''
-        hr = ''
-        first_iter = True
-        for field, attrs in fields.items():
-            if not first_iter:
-                header += '\t'
-                hr += '\t'
-            else:
-                first_iter = False
-            header += f'{field :<{attrs["width"]}}'
-            hr += f'{("=" * attrs["width"]) :<{attrs["width"]}}'
-
-        print(header)
-        print(hr)
+    # Collect every line and emit them with a single write
+    lines = []
+
+    if not args.terse:
+        # Width of every column in a single pass over the interfaces
+        widths = {field: len(field) for field in columns}
+        for if_attrs in results:
+            for field, attr in columns.items():
+                value = getattr(if_attrs, attr)
+                if value and len(value) > widths[field]:
+                    widths[field] = len(value)
+
+        # Compile the column layout into one format string, each row is then a single format() call
+        row_format = '\t'.join(f'{{:<{widths[field]}}}' for field in columns).format
+        lines.append(row_format(*columns))
+        lines.append(row_format(*('=' * widths[field] for field in columns)))
+
+        # Value shown for attributes a firewall doesn't report, in column order
+        na = tuple('' if field == 'Comment' else 'N/A' for field in columns)
+        get_row = attrgetter(*columns.values())
 
     # Print interfaces info
-    for interfaces in results:
-        for ifname, if_attrs in sorted(interfaces.items()):
-            if_status = if_attrs.get('Status', 'N/A')
-            if args.terse:
-                try:
-                    ip = re.match(regex, if_attrs.get('IpAddress', '')).group(1)
-                except AttributeError:
-                    continue
-
-                if not args.if_status or args.if_status in if_status:
-                    print(ip)
-            else:
-                if not args.if_status or args.if_status in if_status:
-                    line = ''
-                    first_iter = True
-                    for field in fields.keys():
-                        if not first_iter:
-                            line += '\t'
-                        else:
-                            first_iter = False
-
-                        if field == 'Interface':
-                            line += f'{ifname :<{fields["Interface"]["width"]}}'
-                            continue
-
-                        attr = if_attrs.get(field, fields[field]["na"])
-                        line += f'{attr :<{fields[field]["width"]}}'
-
-                    print(line)
-
-
-def worker(args, host):
-    url_params = {
-        'type': 'op',
-        'cmd': '<show><interface>all</interface></show>',
-        'key': args.key,
-    }
-    xml = query_api(host, url_params)
+    for if_attrs in results:
+        # Filter first so skipped interfaces are never matched or formatted
+        if args.if_status and args.if_status not in (if_attrs.status or 'N/A'):
+            continue
 
-    if args.raw_output:
-        print_queue.put(xml.split('\n'))
-        return
+        if args.terse:
+            try:
+                ip = ipv4_regex.search(if_attrs.ip_address or '').group(1)
+            except AttributeError:
+                continue
 
-    # Parse interface operational information
-    try:
-        interfaces = parse_interfaces(ET.fromstring(xml), host)
-    except TypeError as err:
-        sys.stderr.write(f'Unable to parse XML! ({err})\n')
-        sys.exit(1)
+            lines.append(ip)
+        else:
+            row = get_row(if_attrs)
+            lines.append(row_format(*(default if value is None else value for value, default in zip(row, na))))
 
-    url_params = {
-        'type': 'config',
-        'action': 'show',
-        'xpath': 'devices/entry/network',
-        'key': args.key,
-    }
-    xml = query_api(host, url_params)
-    root = ET.fromstring(xml)
+    if lines:
+        sys.stdout.write('\n'.join(lines) + '\n')
 
-    # Parse interface configuration
+
+def worker(args, op_params, config_params, host):
+    # A malformed host (e.g. a non-numeric port) is rejected here, report it like any other failed host
     try:
-        interfaces = parse_interface_config(root, interfaces)
-    except TypeError as err:
-        sys.stderr.write(f'Unable to parse XML! ({err})\n')
-        sys.exit(1)
+        conn = http.client.HTTPSConnection(host, context=ssl_ctx)
+    except http.client.HTTPException as err:
+        sys.stderr.write(f'{host}: Unable to connect to host ({err})\n')
+        return
+
+    try:
+        return collect(args, conn, op_params, config_params, host)
+    finally:
+        conn.close()
 
-    results_queue.put(interfaces)
 
+def collect(args, conn, op_params, config_params, host):
+    # Failed hosts are reported on stderr and return None, the other firewalls are still processed
+    xml = query_api(conn, host, op_params)
+    if xml is None:
+        return
 
-def print_manager():
-    while True:
-        job = print_queue.get()
-        for line in job:
-            print(line)
-        print_queue.task_done()
+    if args.raw_output:
+        # Hand back the response as one block rather than a list of split lines
+        return xml.decode('utf-8')
 
+    # Parse interface operational information
+    try:
+        interfaces = parse_interfaces(xml, host)
+    except (TypeError, ET.XMLSyntaxError) as err:
+        sys.stderr.write(f'{host}: Unable to parse XML! ({err})\n')
+        return
 
-def results_manager():
-    global results
+    root = query_api(conn, host, config_params, ET.XMLParser(**xml_parser_options))
+    if root is None:
+        return
 
-    while True:
-        result = results_queue.get()
-        results.append(result)
-        results_queue.task_done()
+    # Parse interface configuration
+    parse_interface_config(root, interfaces)
 
+    return interfaces
 
-def main():
-    # Ctrl+C graceful exit
-    signal.signal(signal.SIGINT, sigint_handler)
 
+def parse_args():
     parser = argparse.ArgumentParser(description='Returns a list of firewalls interfaces')
     parser.add_argument('firewalls', type=str, nargs='*', help='Space separated list of firewalls to query')
     parser.add_argument('-k', '--key', metavar='', type=str, help='API key')
@@ -313,51 +275,32 @@ def main():
     parser.add_argument('-U', '--update', action='store_true', help='Update saved settings')
     parser.add_argument('--if-status', metavar='', choices=['up', 'down'], help='Filter on interface state')
     parser.add_argument('--if-state', metavar='', choices=['up', 'down'], help='DEPRECATED: Filter on interface state')
-    args = parser.parse_args()
+    parser.add_argument('--concurrency', metavar='', type=positive_int, default=25, help='Maximum concurrent API requests (default is 25)')
+    return parser.parse_args()
+
+
+def main():
+    # Ctrl+C graceful exit
+    signal.signal(signal.SIGINT, sigint_handler)
+
+    args = parse_args()
 
     # Deprecated: Remove args.if_state in the near future
     if args.if_state:
         args.if_status = args.if_state
 
-    if 'USERPROFILE' in os.environ:
-        settings_path = os.path.join(os.environ["USERPROFILE"], '.panw-settings.json')
-    else:
-        settings_path = os.path.join(os.environ["HOME"], '.panw-settings.json')
-
     # Import saved settings
-    if os.path.exists(settings_path):
-        with open(settings_path, 'r') as f:
-            settings = json.load(f)
-
-        # Check for the existence of settings and add if missing
-        changed = False
-        if not 'default_firewall' in settings:
-            settings['default_firewall'] = input(f'Default Firewall: ')
-            changed = True
-        if not 'key' in settings:
-            settings['key'] = input('API Key: ')
-            changed = True
-        if changed:
-            with open(settings_path, 'w') as f:
-                json.dump(settings, f, sort_keys=True, indent=2)
-    else:
-        settings = {
-            'default_firewall': input('Default Firewall: '),
-            'key': input('API Key: '),
-        }
-        with open(settings_path, 'w') as f:
-            json.dump(settings, f, sort_keys=True, indent=2)
-        os.chmod(settings_path, 0o600)
+    settings = load_settings(settings_path, {
+        'default_firewall': 'Default Firewall: ',
+        'key': 'API Key: ',
+    })
 
     # Update saved settings
     if args.update:
-        print('\nUpdating saved settings ...\n')
-        settings['key'] = input(f'New API Key [{settings["key"]}]: ') or settings['key']
-        settings['default_firewall'] = input(
-            f'New Default Firewall [{settings["default_firewall"]}]: ') or settings['default_firewall']
-        with open(settings_path, 'w') as f:
-            json.dump(settings, f, sort_keys=True, indent=2)
-        print('\nSettings updated!')
+        update_settings(settings_path, settings, {
+            'key': 'New API Key',
+            'default_firewall': 'New Default Firewall',
+        })
         sys.exit(0)
 
     # Receive firewalls from stdin
@@ -370,32 +313,42 @@ def main():
 
     if not args.key:
         args.key = settings['key']
+    # Empty stdin (e.g. a pipeline that matched nothing) falls back to the default firewall
     if not args.firewalls:
-        args.firewalls = settings['default_firewall']
-
-    # Start print manager
-    t = threading.Thread(target=print_manager)
-    t.daemon = True
-    t.start()
-    del t
-
-    # Results manager
-    t = threading.Thread(target=results_manager)
-    t.daemon = True
-    t.start()
-    del t
-
-    worker_threads = []
-    for host in args.firewalls:
-        t = threading.Thread(target=worker, args=(args, host))
-        worker_threads.append(t)
-        t.start()
-
-    for t in worker_threads:
-        t.join()
-
-    results_queue.join()
-    print_queue.join()
+        args.firewalls = [settings['default_firewall']]
+
+    # Only the host varies between requests, encode both query strings once
+    op_params = urllib.parse.urlencode({
+        'type': 'op',
+        'cmd': '<show><interface>all</interface></show>',
+        'key': args.key,
+    })
+    config_params = urllib.parse.urlencode({
+        'type': 'config',
+        'action': 'show',
+        'xpath': 'devices/entry/network',
+        'key': args.key,
+    })
+
+    # Bounded pool, threads are only spawned as needed so small runs stay small
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(worker, args, op_params, config_params, host) for host in args.firewalls]
+
+        if args.raw_output:
+            # Print each raw response as soon as it arrives
+            for future in as_completed(futures):
+                xml = future.result()
+                if xml is not None:
+                    print(xml)
+            sys.exit(0)
+
+    # Workers return their firewall's interfaces, flatten them and sort once by firewall and interface (natural order)
+    results = []
+    for future in futures:
+        interfaces = future.result()
+        if interfaces is not None:
+            results.extend(interfaces.values())
+    results.sort(key=sort_key)
 
     print_results(args, results)
 
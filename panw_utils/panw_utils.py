@@ -13,15 +13,35 @@ Required Python packages:
 
 Features:
     Returns a list of available commands
+    Runs a command given as the first argument (panw-utils get-panw-config ...)
 '''
 
+import importlib
 import signal
 import sys
 
+# Command name and the module implementing it, only the requested one is imported
+subcommands = {
+    'get-panw-api-key': 'get_panw_api_key',
+    'get-panw-firewalls': 'get_panw_firewalls',
+    'get-panw-interfaces': 'get_panw_interfaces',
+    'get-panw-config': 'get_panw_config',
+    'run-panw-cmd': 'run_panw_cmd',
+    'exec-panw-cmd': 'run_panw_cmd',
+}
+
 def sigint_handler(signum, frame):
     sys.exit(1)
 
 def main():
+    # Dispatch to a command before anything else, so its own imports are the only ones paid for
+    if len(sys.argv) > 1 and sys.argv[1] in subcommands:
+        command = sys.argv.pop(1)
+        # Usage and errors show the command name, as when run directly
+        sys.argv[0] = command
+        module = importlib.import_module(f'panw_utils.{subcommands[command]}')
+        return module.main()
+
     # Ctrl+C graceful exit
     signal.signal(signal.SIGINT, sigint_handler)
 
@@ -35,7 +55,7 @@ def main():
 
     Available commands:
 
-        panw-utils: Returns a list of available commands
+        panw-utils: Returns a list of available commands, or runs one (panw-utils <command> [options])
 
         get-panw-api-key: Returns the current API key, suitable for piping to pbcopy (macOS) or clip.exe (Windows)
 
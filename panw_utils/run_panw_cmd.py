@@ -21,17 +21,15 @@ Features:
 '''
 
 import argparse
+from concurrent.futures import as_completed, ThreadPoolExecutor
 from getpass import getpass
-import json
-from netmiko import ConnectHandler
 import os
 import os.path
-import queue
 import signal
 import sys
-import threading
 
-print_queue = queue.Queue()
+from panw_utils._args import positive_int
+from panw_utils._settings import home_dir, load_settings, settings_path, update_settings
 
 
 def sigint_handler(signum, frame):
@@ -47,48 +45,15 @@ def parse_args():
     parser.add_argument('-u', '--user', metavar='', type=str, help='User')
     parser.add_argument('-p', '--password', metavar='', type=str, help='Password')
     parser.add_argument('-K', '--key-based-auth', action='store_true', help='Use key based authentication')
+    parser.add_argument('--concurrency', metavar='', type=positive_int, default=8,
+                        help='Maximum concurrent SSH sessions, keep below the firewall sshd MaxStartups (default is 8)')
     return parser.parse_args()
 
 
-def import_saved_settings(settings_path):
-    if os.path.exists(settings_path):
-        with open(settings_path, 'r') as f:
-            settings = json.load(f)
-
-        # Check for the existence of settings and add if missing
-        changed = False
-        if not 'default_firewall' in settings:
-            settings['default_firewall'] = input(f'Default Firewall: ')
-            changed = True
-        if not 'default_user' in settings:
-            settings['default_user'] = input('Default User: ')
-            changed = True
-        if changed:
-            with open(settings_path, 'w') as f:
-                json.dump(settings, f, sort_keys=True, indent=2)
-    else:
-        settings = {
-            'default_firewall': [input('Default Firewall: ')],
-            'default_user': input('Default User: '),
-            'key': input('API Key: '),
-        }
-        with open(settings_path, 'w') as f:
-            json.dump(settings, f, sort_keys=True, indent=2)
-        os.chmod(settings_path, 0o600)
-
-    return settings
-
-
-def update_saved_settings(settings, settings_path):
-    print('\nUpdating saved settings ...\n')
-    settings['default_firewall'] = input(f'New Default Firewall [{settings["default_firewall"]}]: ') or settings['default_firewall']
-    settings['default_user'] = input(f'New Default User [{settings["default_user"]}]: ') or settings['default_user']
-    with open(settings_path, 'w') as f:
-        json.dump(settings, f, sort_keys=True, indent=2)
-    print('\nSettings updated!')
-
-
 def connect_ssh(args, settings, key_path, host):
+    # Netmiko (paramiko, cryptography) is slow to import, only load it once a command is actually run
+    from netmiko import ConnectHandler
+
     panos = {
         'host': host,
         'device_type': 'paloalto_panos',
@@ -104,6 +69,7 @@ def connect_ssh(args, settings, key_path, host):
         panos['key_file'] = key_path
         panos['use_keys'] = True
 
+    net_connect = None
     try:
         net_connect = ConnectHandler(**panos)
         output = []
@@ -111,30 +77,21 @@ def connect_ssh(args, settings, key_path, host):
             output.append(f'=== {cmd} ===')
             output.append('\n'.join(net_connect.send_command(cmd).split('\n')[1:]))
     except Exception as e:
-        sys.stderr.write(f'Connection error: {e}\n')
-        sys.exit(1)
+        # Report the failed host and let the rest of the batch carry on
+        sys.stderr.write(f'Connection error ({host}): {e}\n')
+        return
     finally:
-        net_connect.disconnect()
+        if net_connect is not None:
+            net_connect.disconnect()
 
-    print_output(output, host)
+    return output
 
 
 def print_output(output, host):
-    print_queue.put([
-        f'{"=" * (len(host) + 4)}',
-        f'= {host} =',
-        f'{"=" * (len(host) + 4)}',
-        *output,
-        '\n',
-    ])
-
-
-def print_manager():
-    while True:
-        job = print_queue.get()
-        for line in job:
-            print(line)
-        print_queue.task_done()
+    # Emit the banner and output in one write
+    border = '=' * (len(host) + 4)
+    text = '\n'.join([border, f'= {host} =', border, *output, '\n'])
+    sys.stdout.write(text + '\n')
 
 
 def main():
@@ -143,16 +100,17 @@ def main():
 
     args = parse_args()
 
-    if os.environ.get('USERPROFILE'):
-        settings_path = os.path.join(os.environ.get('USERPROFILE'), '.panw-settings.json')
-        key_path = os.path.join(os.environ.get('USERPROFILE'), '.ssh', 'id_rsa')
-    else:
-        settings_path = os.path.join(os.environ.get('HOME'), '.panw-settings.json')
-        key_path = os.path.join(os.environ.get('HOME'), '.ssh', 'id_rsa')
-    settings = import_saved_settings(settings_path)
+    key_path = os.path.join(home_dir, '.ssh', 'id_rsa')
+    settings = load_settings(settings_path, {
+        'default_firewall': 'Default Firewall: ',
+        'default_user': 'Default User: ',
+    })
 
     if args.update:
-        update_saved_settings(settings, settings_path)
+        update_settings(settings_path, settings, {
+            'default_firewall': 'New Default Firewall',
+            'default_user': 'New Default User',
+        })
         sys.exit(0)
 
     # Receive firewalls from stdin
@@ -168,24 +126,15 @@ def main():
     if not args.key_based_auth and not args.password:
         args.password = getpass(f"Password ({args.user}): ")
 
-    # Start print manager
-    t = threading.Thread(target=print_manager)
-    t.daemon = True
-    t.start()
-    del t
-
-    # Execute CLI commands and print output
+    # Execute CLI commands, workers return their output to be printed here as each one finishes
     print('Connecting via SSH ...', file=sys.stderr)
-    worker_threads = []
-    for host in args.firewalls:
-        t = threading.Thread(target=connect_ssh, args=(args, settings, key_path, host))
-        worker_threads.append(t)
-        t.start()
-
-    for t in worker_threads:
-        t.join()
-
-    print_queue.join()
+    # Netmiko sessions are heavyweight (a paramiko transport thread each), keep a bounded number in flight
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = {executor.submit(connect_ssh, args, settings, key_path, host): host for host in args.firewalls}
+        for future in as_completed(futures):
+            output = future.result()
+            if output is not None:
+                print_output(output, futures[future])
 
     sys.exit(0)
 
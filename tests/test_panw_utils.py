@@ -4,9 +4,19 @@
 """Tests for `panw_utils` package."""
 
 
+import argparse
+import contextlib
+import io
+import json
+import os
+import stat
+import tempfile
 import unittest
+from unittest import mock
 
-from panw_utils import panw_utils
+import lxml.etree as ET
+
+from panw_utils import _settings, get_panw_api_key, get_panw_config, get_panw_firewalls, get_panw_interfaces, panw_utils
 
 
 class TestPanw_utils(unittest.TestCase):
@@ -20,3 +30,372 @@ class TestPanw_utils(unittest.TestCase):
 
     def test_000_something(self):
         """Test something."""
+
+
+class TestTrimLines(unittest.TestCase):
+    """Tests for `get_panw_config.trim_lines`."""
+
+    def test_matches_slice_expression(self):
+        """Same result as sep.join(text.split(sep)[count:-count])."""
+        sep = '\\n'
+        for lines in range(0, 13):
+            text = sep.join(f'line{i}' for i in range(lines))
+            for count in (1, 4):
+                with self.subTest(lines=lines, count=count):
+                    expected = sep.join(text.split(sep)[count:-count])
+                    self.assertEqual(get_panw_config.trim_lines(text, sep, count), expected)
+
+    def test_too_few_lines(self):
+        """Fewer than 2 * count lines leave nothing."""
+        self.assertEqual(get_panw_config.trim_lines('a\\nb\\nc', '\\n', 4), '')
+        self.assertEqual(get_panw_config.trim_lines('', '\\n', 4), '')
+
+
+
+class TestSettings(unittest.TestCase):
+    """Tests for `_settings`."""
+
+    def setUp(self):
+        """Set up a settings file in a temporary directory."""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.settings_path = os.path.join(self.tmp_dir.name, '.panw-settings.json')
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        self.tmp_dir.cleanup()
+
+    def write_settings(self, settings):
+        """Write a settings file as a previous run would have."""
+        with open(self.settings_path, 'w') as f:
+            json.dump(settings, f)
+
+    def read_settings(self):
+        """Read back the saved settings file."""
+        with open(self.settings_path) as f:
+            return json.load(f)
+
+    def test_load_settings_complete(self):
+        """Saved settings are returned without prompting or rewriting the file."""
+        self.write_settings({'key': 'abc', 'default_firewall': 'fw1'})
+        with mock.patch('builtins.input') as prompt, \
+                mock.patch.object(_settings, 'save_settings') as save_settings:
+            settings = _settings.load_settings(self.settings_path, {'key': '', 'default_firewall': ''})
+        self.assertEqual(settings, {'key': 'abc', 'default_firewall': 'fw1'})
+        prompt.assert_not_called()
+        save_settings.assert_not_called()
+
+    def test_load_settings_missing(self):
+        """Missing settings are prompted for and saved."""
+        self.write_settings({'key': 'abc'})
+        with mock.patch('builtins.input', return_value='fw1'):
+            settings = _settings.load_settings(self.settings_path, {'key': '', 'default_firewall': ''})
+        self.assertEqual(settings, {'key': 'abc', 'default_firewall': 'fw1'})
+        self.assertEqual(self.read_settings(), settings)
+
+    def test_load_settings_legacy_default_firewall(self):
+        """A default firewall saved as a one element list is unwrapped and resaved."""
+        self.write_settings({'default_firewall': ['fw1'], 'key': 'abc'})
+        settings = _settings.load_settings(self.settings_path, {'default_firewall': '', 'key': ''})
+        self.assertEqual(settings['default_firewall'], 'fw1')
+        self.assertEqual(self.read_settings()['default_firewall'], 'fw1')
+
+    def test_load_settings_legacy_empty_default_firewall(self):
+        """An empty legacy list is prompted for like a missing setting."""
+        self.write_settings({'default_firewall': [], 'key': 'abc'})
+        with mock.patch('builtins.input', return_value='fw2'):
+            settings = _settings.load_settings(self.settings_path, {'default_firewall': '', 'key': ''})
+        self.assertEqual(settings['default_firewall'], 'fw2')
+
+    def test_save_settings(self):
+        """Settings are written in full and no temporary file is left behind."""
+        self.write_settings({'key': 'old'})
+        _settings.save_settings(self.settings_path, {'key': 'abc'})
+        self.assertEqual(self.read_settings(), {'key': 'abc'})
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['.panw-settings.json'])
+
+    @unittest.skipIf(os.name == 'nt', 'POSIX file modes')
+    def test_save_settings_mode(self):
+        """The settings file (it holds the API key) is only readable by its owner."""
+        _settings.save_settings(self.settings_path, {'key': 'abc'})
+        self.assertEqual(stat.S_IMODE(os.stat(self.settings_path).st_mode), 0o600)
+
+    def test_save_settings_interrupted(self):
+        """A failed write keeps the previous file and removes the temporary one."""
+        self.write_settings({'key': 'old'})
+        with mock.patch.object(_settings.json, 'dump', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                _settings.save_settings(self.settings_path, {'key': 'abc'})
+        self.assertEqual(self.read_settings(), {'key': 'old'})
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['.panw-settings.json'])
+
+    def test_update_settings_unchanged(self):
+        """Keeping every value does not rewrite the file."""
+        settings = {'key': 'abc', 'default_firewall': 'fw1'}
+        prompts = {'key': 'New API Key', 'default_firewall': 'New Default Firewall'}
+        with mock.patch('builtins.input', return_value=''), \
+                mock.patch.object(_settings, 'save_settings') as save_settings, \
+                contextlib.redirect_stdout(io.StringIO()):
+            _settings.update_settings(self.settings_path, settings, prompts)
+        save_settings.assert_not_called()
+        self.assertEqual(settings, {'key': 'abc', 'default_firewall': 'fw1'})
+
+    def test_update_settings_changed(self):
+        """A new value is saved."""
+        settings = {'key': 'abc'}
+        with mock.patch('builtins.input', return_value='xyz'), \
+                mock.patch.object(_settings, 'save_settings') as save_settings, \
+                contextlib.redirect_stdout(io.StringIO()):
+            _settings.update_settings(self.settings_path, settings, {'key': 'New API Key'})
+        save_settings.assert_called_once_with(self.settings_path, {'key': 'xyz'})
+
+
+class TestInterfaceSortKey(unittest.TestCase):
+    """Tests for `get_panw_interfaces.sort_key`."""
+
+    def test_natural_order(self):
+        """Interfaces sort by firewall, then numerically within names."""
+        Interface = get_panw_interfaces.Interface
+        interfaces = [
+            Interface('fw2', 'ethernet1/1'),
+            Interface('fw1', 'ethernet1/10'),
+            Interface('fw1', 'ethernet1/2'),
+            Interface('fw1', 'ethernet1/10.100'),
+            Interface('fw1', 'ethernet1/10.20'),
+            Interface('fw1', 'ae1'),
+        ]
+        interfaces.sort(key=get_panw_interfaces.sort_key)
+        self.assertEqual([(i.firewall, i.ifname) for i in interfaces], [
+            ('fw1', 'ae1'),
+            ('fw1', 'ethernet1/2'),
+            ('fw1', 'ethernet1/10'),
+            ('fw1', 'ethernet1/10.20'),
+            ('fw1', 'ethernet1/10.100'),
+            ('fw2', 'ethernet1/1'),
+        ])
+
+
+class TestParseInterfaces(unittest.TestCase):
+    """Tests for `get_panw_interfaces.parse_interfaces`."""
+
+    hw = (
+        '<hw>'
+        '<entry><name>ethernet1/1</name><st>1000/full/up</st><mac>00:01:02:03:04:01</mac></entry>'
+        '<entry><name>ethernet1/2</name><st>ukn/ukn/down(autoneg)</st><mac>00:01:02:03:04:02</mac></entry>'
+        '</hw>'
+    )
+    ifnet = (
+        '<ifnet>'
+        '<entry><name>ethernet1/1</name><zone>trust</zone><vsys>1</vsys><ip>10.1.1.1/24</ip></entry>'
+        '<entry><name>loopback.1</name><zone>mgmt</zone><vsys>0</vsys><ip>1.1.1.1</ip></entry>'
+        '</ifnet>'
+    )
+
+    def parse(self, sections):
+        """Parse a show interface all response made of the given sections."""
+        xml = f'<response status="success"><result>{sections}</result></response>'
+        return get_panw_interfaces.parse_interfaces(xml.encode('utf-8'), 'fw1')
+
+    def test_merge_hw_and_ifnet(self):
+        """hw and ifnet entries for the same interface are merged, in either order."""
+        for sections in (self.ifnet + self.hw, self.hw + self.ifnet):
+            with self.subTest(hw_first=sections.startswith('<hw>')):
+                interfaces = self.parse(sections)
+                self.assertEqual(sorted(interfaces), ['ethernet1/1', 'ethernet1/2', 'loopback.1'])
+
+                eth1 = interfaces['ethernet1/1']
+                self.assertEqual(eth1.firewall, 'fw1')
+                self.assertEqual(eth1.status, '1000/full/up')
+                self.assertEqual(eth1.mac_address, '00:01:02:03:04:01')
+                self.assertEqual(eth1.zone, 'trust')
+                self.assertEqual(eth1.ip_address, '10.1.1.1/24')
+                self.assertEqual(eth1.vsys, 'vsys1')
+
+                # Interfaces only reported in one section keep the other's attributes unset
+                self.assertIsNone(interfaces['ethernet1/2'].zone)
+                self.assertIsNone(interfaces['loopback.1'].mac_address)
+
+    def test_other_entries_skipped(self):
+        """Entries outside hw/ifnet, including ones nested in an interface entry, are ignored."""
+        sections = (
+            '<hw><entry><name>ae1</name><st>up</st><members><entry><name>ethernet1/5</name></entry></members></entry></hw>'
+            '<counters><entry><name>ethernet1/9</name></entry></counters>'
+        )
+        interfaces = self.parse(sections)
+        self.assertEqual(list(interfaces), ['ae1'])
+        self.assertEqual(interfaces['ae1'].status, 'up')
+
+    def test_many_entries(self):
+        """Pruning processed siblings never loses an entry."""
+        entries = ''.join(f'<entry><name>ethernet1/{i}</name><st>up</st><mac>m{i}</mac></entry>' for i in range(1, 201))
+        interfaces = self.parse(f'<hw>{entries}</hw>')
+        self.assertEqual(len(interfaces), 200)
+        self.assertEqual(interfaces['ethernet1/137'].mac_address, 'm137')
+
+    def test_missing_fields(self):
+        """Absent or empty ifnet fields read as N/A, vsys 0 means no vsys."""
+        sections = (
+            '<ifnet>'
+            '<entry><name>ethernet1/3</name><zone/><vsys>2</vsys></entry>'
+            '<entry><name>ethernet1/4</name><ip>N/A</ip><vsys>0</vsys></entry>'
+            '</ifnet>'
+            '<hw><entry><name>ethernet1/5</name></entry></hw>'
+        )
+        interfaces = self.parse(sections)
+
+        eth3 = interfaces['ethernet1/3']
+        self.assertEqual((eth3.ip_address, eth3.zone, eth3.vsys), ('N/A', 'N/A', 'vsys2'))
+        eth4 = interfaces['ethernet1/4']
+        self.assertEqual((eth4.ip_address, eth4.zone, eth4.vsys), ('N/A', 'N/A', 'N/A'))
+        eth5 = interfaces['ethernet1/5']
+        self.assertEqual((eth5.status, eth5.mac_address), (None, None))
+
+
+class TestParseInterfaceConfig(unittest.TestCase):
+    """Tests for `get_panw_interfaces.parse_interface_config`."""
+
+    config = (
+        '<response status="success"><result><network>'
+        '<interface>'
+        '<ethernet>'
+        '<entry name="ethernet1/1"><comment>Inside link</comment><link-state>up</link-state></entry>'
+        '<entry name="ethernet1/2"><aggregate-group>ae1</aggregate-group></entry>'
+        '<entry name="ethernet1/3"><layer3><units>'
+        '<entry name="ethernet1/3.10"><comment>Not the parent</comment></entry>'
+        '</units></layer3></entry>'
+        '</ethernet>'
+        '<aggregate-ethernet><entry name="ae1"><layer3><interface><member>ethernet1/4</member></interface></layer3></entry></aggregate-ethernet>'
+        '</interface>'
+        '<virtual-router>'
+        '<entry name="default"><interface><member>ethernet1/1</member><member>ethernet1/3.10</member></interface></entry>'
+        '<entry name="backup"><interface><member>ethernet1/1</member><member>ethernet1/2</member></interface></entry>'
+        '</virtual-router>'
+        '</network></result></response>'
+    )
+
+    def parse(self, ifnames):
+        """Apply the config fixture to fresh interfaces with the given names."""
+        interfaces = {ifname: get_panw_interfaces.Interface('fw1', ifname) for ifname in ifnames}
+        get_panw_interfaces.parse_interface_config(ET.fromstring(self.config), interfaces)
+        return interfaces
+
+    def test_ethernet_config(self):
+        """Comment, link state and aggregate group come from the interface's own ethernet entry."""
+        interfaces = self.parse(['ethernet1/1', 'ethernet1/2', 'ethernet1/3'])
+
+        eth1 = interfaces['ethernet1/1']
+        self.assertEqual((eth1.comment, eth1.link_state, eth1.agg_grp), ('Inside link', 'up', 'N/A'))
+        eth2 = interfaces['ethernet1/2']
+        self.assertEqual((eth2.comment, eth2.link_state, eth2.agg_grp), ('', 'auto', 'ae1'))
+        # A subinterface's comment is not the parent's
+        self.assertEqual(interfaces['ethernet1/3'].comment, '')
+
+    def test_non_physical_interfaces(self):
+        """Interfaces without ethernet config have no comment, link state or aggregate group."""
+        interfaces = self.parse(['ethernet1/3.10', 'loopback.1'])
+        for attrs in interfaces.values():
+            self.assertEqual((attrs.comment, attrs.link_state, attrs.agg_grp), ('', None, None))
+
+    def test_virtual_routers(self):
+        """Only virtual-router members count, the first router listing an interface wins."""
+        interfaces = self.parse(['ethernet1/1', 'ethernet1/2', 'ethernet1/3.10', 'ethernet1/4', 'loopback.1'])
+        self.assertEqual({ifname: attrs.vrouter for ifname, attrs in interfaces.items()}, {
+            'ethernet1/1': 'default',
+            'ethernet1/2': 'backup',
+            'ethernet1/3.10': 'default',
+            'ethernet1/4': 'N/A',
+            'loopback.1': 'N/A',
+        })
+
+
+class TestParseFirewalls(unittest.TestCase):
+    """Tests for `get_panw_firewalls.parse_xml`."""
+
+    devices = (
+        b'<response status="success"><result><devices>'
+        b'<entry name="001"><serial>001</serial><connected>yes</connected><hostname>FW-B</hostname>'
+        b'<ip-address>10.0.0.2</ip-address><model>PA-220</model><uptime>1 days</uptime><sw-version>9.1.0</sw-version>'
+        b'<vsys><entry name="vsys1"><display-name>vsys1</display-name></entry></vsys></entry>'
+        b'<entry name="002"><serial>002</serial><connected>no</connected><hostname>FW-A</hostname></entry>'
+        b'<entry name="003"><serial>003</serial></entry>'
+        b'</devices></result></response>'
+    )
+
+    def parse(self, state='all'):
+        """Parse the device list fixture with the given --state filter."""
+        return list(get_panw_firewalls.parse_xml(argparse.Namespace(state=state), io.BytesIO(self.devices)))
+
+    def test_devices_only(self):
+        """One Firewall per device entry, nested vsys entries are not firewalls."""
+        firewalls = self.parse()
+        self.assertEqual([fw.serial for fw in firewalls], ['001', '002', '003'])
+        self.assertEqual(firewalls[0], get_panw_firewalls.Firewall(
+            'fw-b.wsgc.com', '10.0.0.2', '001', 'PA-220', 'yes', '1 days', '9.1.0'))
+
+    def test_missing_fields(self):
+        """Missing fields read n/a, a missing connected state reads no."""
+        self.assertEqual(self.parse()[2], get_panw_firewalls.Firewall(
+            'n/a', 'n/a', '003', 'n/a', 'no', 'n/a', 'n/a'))
+
+    def test_state_filter(self):
+        """Connected firewalls are dropped when asking for disconnected ones."""
+        for state in ('disconnected', 'not-connected'):
+            with self.subTest(state=state):
+                self.assertEqual([fw.serial for fw in self.parse(state)], ['002', '003'])
+
+    def test_generator(self):
+        """Firewalls are yielded as they are parsed rather than returned as a list."""
+        firewalls = get_panw_firewalls.parse_xml(argparse.Namespace(state='all'), io.BytesIO(self.devices))
+        self.assertEqual(next(firewalls).serial, '001')
+
+    def test_sort_firewalls(self):
+        """Firewalls sort by hostname, the ones without a hostname (n/a) last."""
+        Firewall = get_panw_firewalls.Firewall
+        # 'zz' sorts after 'n/a' as a string, it must still come before it
+        hostnames = ['zz.wsgc.com', 'n/a', 'fw-b.wsgc.com', 'n/a', 'fw-a.wsgc.com']
+        firewalls = get_panw_firewalls.sort_firewalls(Firewall(name, *['n/a'] * 6) for name in hostnames)
+        self.assertEqual([fw.hostname for fw in firewalls], ['fw-a.wsgc.com', 'fw-b.wsgc.com', 'zz.wsgc.com', 'n/a', 'n/a'])
+
+
+class TestApiKeyWorker(unittest.TestCase):
+    """Tests for `get_panw_api_key.worker`."""
+
+    def run_worker(self, response, verbose=False):
+        """Run the worker on a canned keygen response, returning its result, stdout and stderr."""
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch.object(get_panw_api_key, 'query_api', return_value=response), \
+                contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            result = get_panw_api_key.worker(argparse.Namespace(verbose=verbose), '', 'fw1')
+        return result, stdout.getvalue(), stderr.getvalue()
+
+    def test_regex_fast_path(self):
+        """A plain <key> element is matched without parsing the XML."""
+        response = b"<response status = 'success'><result><key>LUFRPT1=</key></result></response>"
+        with mock.patch.object(get_panw_api_key.ET, 'fromstring') as fromstring:
+            self.assertEqual(self.run_worker(response), (True, 'LUFRPT1=\n', ''))
+        fromstring.assert_not_called()
+
+    def test_xml_fallback(self):
+        """A key the regex misses is still found by the XML parser."""
+        response = b"<response status = 'success'><result><key type='api'>LUFRPT1=</key></result></response>"
+        self.assertEqual(self.run_worker(response), (True, 'LUFRPT1=\n', ''))
+
+    def test_verbose(self):
+        """Verbose output prefixes the key with its host."""
+        response = b'<response><result><key>LUFRPT1=</key></result></response>'
+        self.assertEqual(self.run_worker(response, verbose=True)[1], f'{"fw1: ":30}LUFRPT1=\n')
+
+    def test_error_response(self):
+        """An error response reports the host and PAN-OS message."""
+        response = b"<response status = 'error' code = '403'><result><msg>Invalid Credential</msg></result></response>"
+        self.assertEqual(self.run_worker(response), (False, '', 'fw1: Unable to parse API key! (Invalid Credential)\n'))
+
+    def test_not_xml(self):
+        """A response that is not XML is reported instead of raising."""
+        result, stdout, stderr = self.run_worker(b'not xml at all')
+        self.assertFalse(result)
+        self.assertEqual(stdout, '')
+        self.assertTrue(stderr.startswith('fw1: Unable to parse XML!'))
+
+    def test_connection_failed(self):
+        """A host that could not be queried is skipped (query_api already reported it)."""
+        self.assertEqual(self.run_worker(None), (False, '', ''))